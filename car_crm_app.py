@@ -23,6 +23,9 @@ try:
 except ImportError:
     GMAIL_API_AVAILABLE = False
 
+# Country code assumed for 10-digit phone numbers
+DEFAULT_COUNTRY_CODE = "1"
+
 # Page configuration
 st.set_page_config(
     page_title="VelocityCarDeals CRM",
@@ -107,10 +110,6 @@ st.markdown("""
 # Initialize session states with error handling
 def initialize_session_state():
     try:
-        if "contact_data" not in st.session_state:
-            st.session_state.contact_data = pd.DataFrame(
-                columns=["Name", "Phone", "Type", "Associated VIN"]
-            )
         if "crm_data" not in st.session_state:
             st.session_state.crm_data = pd.DataFrame(
                 columns=[
@@ -130,6 +129,112 @@ def initialize_session_state():
         st.error(f"Error initializing session state: {str(e)}")
         st.stop()
 
+# Contact graph setup, run on every script run so existing sessions pick it up
+def initialize_contact_graph():
+    if "contacts" not in st.session_state:
+        # Contacts keyed by E.164 phone; VIN links are indexed both ways and carry the contact's role
+        st.session_state.contacts = {}
+        st.session_state.contacts_by_vin = {}
+        st.session_state.vins_by_contact = {}
+        # Contacts added without a VIN, kept when their last VIN link goes away
+        st.session_state.standalone_contacts = set()
+    if "contact_data" in st.session_state:
+        # Flat one-row-per-VIN contacts from older sessions
+        try:
+            legacy_contacts = st.session_state.contact_data
+            unrecognized = normalize_phones(legacy_contacts["Phone"]).isna().sum()
+            migrated = merge_contacts(legacy_contacts, keep_unrecognized=True)
+            del st.session_state.contact_data
+            dropped = len(legacy_contacts) - migrated
+            if unrecognized > dropped:
+                st.warning(f"{unrecognized - dropped} existing contacts kept with unrecognized phone numbers")
+            if dropped:
+                st.warning(f"{dropped} existing contacts without a phone number could not be migrated")
+        except Exception as e:
+            st.error(f"Error migrating contacts: {str(e)}")
+
+def get_vin_options():
+    """VIN selectbox options, rebuilt only when crm_data is replaced"""
+    if st.session_state.get("vin_options_source") is not st.session_state.crm_data:
+        st.session_state.vin_options = ["None"] + st.session_state.crm_data["VIN"].tolist()
+        st.session_state.vin_options_source = st.session_state.crm_data
+    return st.session_state.vin_options
+
+def normalize_phones(phones):
+    """Vectorized E.164 normalization; unrecognized numbers become NA"""
+    # Numeric phones (e.g. 5551234567.0 from a float column) lose their ".0" before parsing
+    raw = phones.map(lambda p: str(int(p)) if isinstance(p, float) and p.is_integer() else p)
+    raw = raw.fillna("").astype(str).str.strip()
+    # Trailing extensions are not part of the E.164 number
+    raw = raw.str.replace(r"(?i)\s*(?:(?<![a-z])(?:ext\.?|x)|#)\s*\d+\s*$", "", regex=True)
+    digits = raw.str.replace(r"\D", "", regex=True)
+    # "00" is the international call prefix, equivalent to a leading "+"
+    dialed_out = raw.str.startswith("00")
+    digits = digits.mask(dialed_out, digits.str[2:])
+    international = raw.str.startswith("+") | dialed_out
+    national = ~international & (digits.str.len() == 10)
+    trunk = ~international & (digits.str.len() == 11) & digits.str.startswith(DEFAULT_COUNTRY_CODE)
+
+    e164 = pd.Series(pd.NA, index=phones.index, dtype="object")
+    e164[international | trunk] = "+" + digits[international | trunk]
+    e164[national] = "+" + DEFAULT_COUNTRY_CODE + digits[national]
+    # E.164 allows at most 15 digits and country codes never start with 0
+    valid = e164.str.len().between(9, 16) & ~(international & digits.str.startswith("0"))
+    return e164.where(valid, pd.NA)
+
+def normalize_phone(phone):
+    """Normalize a single phone number to E.164, or None if unrecognized"""
+    normalized = normalize_phones(pd.Series([phone], dtype="object")).iloc[0]
+    return None if pd.isna(normalized) else normalized
+
+def merge_contacts(records, overwrite=False, keep_unrecognized=False):
+    """Dedup Name/Phone/Type/Associated VIN rows by phone into the contact graph; returns rows merged"""
+    phones = normalize_phones(records["Phone"])
+    if keep_unrecognized:
+        raw_phones = records["Phone"].fillna("").astype(str).str.strip()
+        phones = phones.fillna(raw_phones.replace("", pd.NA))
+    records = records.assign(Phone=phones).dropna(subset=["Phone"])
+    if records.empty:
+        return 0
+    if "Associated VIN" in records.columns:
+        vins = records["Associated VIN"].fillna("").astype(str).str.strip()
+    else:
+        vins = pd.Series("", index=records.index)
+    records = records.assign(VIN=vins, Name=records["Name"].replace("", pd.NA), Type=records["Type"].replace("", pd.NA))
+
+    contacts = st.session_state.contacts
+    for phone, name, contact_type in records.groupby("Phone", sort=False)[["Name", "Type"]].first().itertuples():
+        contact = contacts.setdefault(phone, {"Name": None, "Type": None})
+        for field, value in (("Name", name), ("Type", contact_type)):
+            if not pd.isna(value) and (overwrite or contact[field] is None):
+                contact[field] = value
+
+    links = records.loc[records["VIN"] != "", ["Phone", "VIN", "Type"]].drop_duplicates(["Phone", "VIN"])
+    for phone, vin, role in links.itertuples(index=False):
+        linked = st.session_state.contacts_by_vin.setdefault(vin, {})
+        if overwrite or phone not in linked:
+            linked[phone] = None if pd.isna(role) else role
+        st.session_state.vins_by_contact.setdefault(phone, set()).add(vin)
+    st.session_state.standalone_contacts.update(records.loc[records["VIN"] == "", "Phone"])
+
+    return len(records)
+
+def add_contact(name, phone, contact_type, vin="", overwrite=True):
+    """Add or update a single contact, linking it to vin if given. Returns False for an unrecognized phone."""
+    new_contact = pd.DataFrame([[name, phone, contact_type, vin]],
+                               columns=["Name", "Phone", "Type", "Associated VIN"])
+    return merge_contacts(new_contact, overwrite=overwrite) > 0
+
+def unlink_vin(vin):
+    """Drop every link to vin in O(k), removing non-standalone contacts left without any VIN"""
+    for phone in st.session_state.contacts_by_vin.pop(vin, {}):
+        linked_vins = st.session_state.vins_by_contact[phone]
+        linked_vins.discard(vin)
+        if not linked_vins:
+            del st.session_state.vins_by_contact[phone]
+            if phone not in st.session_state.standalone_contacts:
+                del st.session_state.contacts[phone]
+
 # Gmail API integration function
 def send_email_gmail(recipient, subject, body_text):
     if not GMAIL_API_AVAILABLE:
@@ -291,15 +396,16 @@ def show_add_car():
                     # Check for duplicate VIN
                     if not st.session_state.crm_data.empty and vin in st.session_state.crm_data["VIN"].values:
                         st.error("A car with this VIN already exists!")
+                    elif contact_name and contact_phone and normalize_phone(contact_phone) is None:
+                        st.error("Seller phone number not recognized. Use a 10-digit US number or +<country code><number>")
                     else:
                         new_row = pd.DataFrame([[vin, make, model, year, None, None, None, None, None, "Watch"]], 
                                              columns=st.session_state.crm_data.columns)
                         st.session_state.crm_data = pd.concat([st.session_state.crm_data, new_row], ignore_index=True)
                         
                         if contact_name and contact_phone:
-                            new_contact = pd.DataFrame([[contact_name, contact_phone, "Seller", vin]], 
-                                                     columns=st.session_state.contact_data.columns)
-                            st.session_state.contact_data = pd.concat([st.session_state.contact_data, new_contact], ignore_index=True)
+                            # Seller is this car's role; an existing contact keeps its own Name/Type
+                            add_contact(contact_name, contact_phone, "Seller", vin, overwrite=False)
                         
                         st.success(f"✅ {year} {make} {model} added to watchlist!")
                         st.rerun()
@@ -443,8 +549,8 @@ def update_sold_info(vin, sold_date, sold_price):
 def delete_car(vin):
     try:
         st.session_state.crm_data = st.session_state.crm_data[st.session_state.crm_data["VIN"] != vin]
-        # Also remove associated contacts
-        st.session_state.contact_data = st.session_state.contact_data[st.session_state.contact_data["Associated VIN"] != vin]
+        # Also unlink associated contacts
+        unlink_vin(vin)
         st.success(f"✅ Car {vin} deleted successfully")
         st.rerun()
     except Exception as e:
@@ -504,24 +610,35 @@ def handle_contact_management():
             name = st.text_input("Contact Name")
             phone = st.text_input("Phone Number")
             contact_type = st.selectbox("Contact Type", ["Seller", "Buyer", "Dealer", "Other"])
-            associated_vin = st.selectbox("Associated VIN (Optional)", 
-                                       ["None"] + st.session_state.crm_data["VIN"].tolist() 
-                                       if not st.session_state.crm_data.empty else ["None"])
+            associated_vin = st.selectbox("Associated VIN (Optional)", get_vin_options())
             
             if st.form_submit_button("Add Contact", type="primary"):
                 if name and phone:
                     vin_value = associated_vin if associated_vin != "None" else ""
-                    new_contact = pd.DataFrame([[name, phone, contact_type, vin_value]], 
-                                             columns=st.session_state.contact_data.columns)
-                    st.session_state.contact_data = pd.concat([st.session_state.contact_data, new_contact], ignore_index=True)
-                    st.success("Contact added!")
-                    st.rerun()
+                    if add_contact(name, phone, contact_type, vin_value):
+                        st.success("Contact saved!")
+                        st.rerun()
+                    else:
+                        st.error("Phone number not recognized. Use a 10-digit US number or +<country code><number>")
                 else:
                     st.error("Please provide name and phone number")
     
     with tab2:
-        if not st.session_state.contact_data.empty:
-            st.dataframe(st.session_state.contact_data, use_container_width=True)
+        if st.session_state.contacts:
+            filter_vin = st.selectbox("Filter by VIN", get_vin_options())
+            contacts = st.session_state.contacts
+            vins_by_contact = st.session_state.vins_by_contact
+            if filter_vin != "None":
+                links = st.session_state.contacts_by_vin.get(filter_vin, {})
+                rows = [{"Phone": phone, **contacts[phone], "Role": role} for phone, role in links.items()]
+            else:
+                rows = [{"Phone": phone, **contact} for phone, contact in contacts.items()]
+            for row in rows:
+                row["VINs"] = ", ".join(sorted(vins_by_contact.get(row["Phone"], ())))
+            if rows:
+                st.dataframe(pd.DataFrame(rows), use_container_width=True)
+            else:
+                st.info("No contacts linked to this VIN.")
         else:
             st.info("No contacts yet.")
 
@@ -655,6 +772,9 @@ if "initialized" not in st.session_state:
     initialize_session_state()
     st.session_state.initialized = True
 
+# Set up (or migrate) the contact graph on every run
+initialize_contact_graph()
+
 # Run the main application
 if __name__ == "__main__":
     main()